@@ -1,20 +1,28 @@
 from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
 import os
 import logging
 import asyncio
 import json
+import time
+import threading
+import itertools
+import math
+import operator
+import orjson
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Dict, Optional, Literal
-import uuid
-from datetime import datetime, timezone
-from sortedcontainers import SortedDict
-from collections import deque
-from decimal import Decimal
+from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Literal, Tuple, Iterator
+from datetime import datetime, timedelta, timezone
+from sortedcontainers import SortedList, SortedKeyList
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
@@ -25,7 +33,7 @@ mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME', 'matching_engine')]
 
-app = FastAPI(title="CryptoMatch Engine API")
+app = FastAPI(title="CryptoMatch Engine API", default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # Configure logging
@@ -44,31 +52,6 @@ class OrderSubmission(BaseModel):
     quantity: float
     price: Optional[float] = None
 
-class Order(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    
-    order_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    symbol: str
-    order_type: str
-    side: str
-    quantity: float
-    price: Optional[float] = None
-    remaining_quantity: float
-    status: str = "open"  # open, partially_filled, filled, cancelled
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class Trade(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    
-    trade_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    symbol: str
-    price: float
-    quantity: float
-    aggressor_side: str
-    maker_order_id: str
-    taker_order_id: str
-
 class BBO(BaseModel):
     symbol: str
     best_bid: Optional[float] = None
@@ -83,355 +66,1048 @@ class OrderBookSnapshot(BaseModel):
     bids: List[List[float]]  # [[price, quantity], ...]
     asks: List[List[float]]  # [[price, quantity], ...]
 
+# ============== BOOK RECORDS ==============
+# Slotted, unvalidated records used inside the engine. At the database / WebSocket /
+# REST boundary they are emitted as plain dicts by their to_doc() methods.
+
+SIDE_BUY, SIDE_SELL = 0, 1
+TYPE_MARKET, TYPE_LIMIT, TYPE_IOC, TYPE_FOK = 0, 1, 2, 3
+STATUS_OPEN, STATUS_PARTIALLY_FILLED, STATUS_FILLED, STATUS_CANCELLED = 0, 1, 2, 3
+
+SIDES = ("buy", "sell")
+ORDER_TYPES = ("market", "limit", "ioc", "fok")
+STATUSES = ("open", "partially_filled", "filled", "cancelled")
+
+# Symbols are interned as small ints on first sight
+SYMBOL_IDS: Dict[str, int] = {}
+
+def symbol_id(symbol: str) -> int:
+    sid = SYMBOL_IDS.get(symbol)
+    if sid is None:
+        sid = SYMBOL_IDS[symbol] = len(SYMBOL_IDS)
+    return sid
+
+# Snowflake-style IDs: 41 bits of ms since ID_EPOCH_MS | 9-bit node | 1-bit kind | 12-bit sequence.
+# Fits a signed 64-bit int until 2093; the kind bit keeps order and trade IDs disjoint.
+ID_EPOCH_MS = 1_704_067_200_000  # 2024-01-01T00:00:00Z
+ID_KIND_ORDER, ID_KIND_TRADE = 0, 1
+NODE_ID = int(os.environ.get("NODE_ID", "0"))  # 0-511, unique per engine process
+
+class IdAllocator:
+    """Monotonic IDs that never repeat across restarts, kinds or nodes"""
+    __slots__ = ("_worker", "_ms", "_seq", "_lock")
+
+    def __init__(self, kind: int, node: int = NODE_ID):
+        if not 0 <= node < 512:
+            raise ValueError(f"NODE_ID must be in 0-511, got {node}")
+        self._worker = ((node << 1) | kind) << 12
+        self._ms = -1
+        self._seq = 0
+        # Trade IDs are drawn from matching threads of different symbols concurrently
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> "IdAllocator":
+        return self
+
+    def __next__(self) -> int:
+        ms = time.time_ns() // 1_000_000 - ID_EPOCH_MS
+        with self._lock:
+            if ms > self._ms:
+                self._ms, self._seq = ms, 0
+            else:
+                self._seq += 1
+                if self._seq > 0xFFF:
+                    # Sequence exhausted (or the clock stepped back): borrow the next millisecond
+                    self._ms += 1
+                    self._seq = 0
+            return (self._ms << 22) | self._worker | self._seq
+
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def iso_timestamp(ts_us: int) -> str:
+    """ISO-8601 UTC form of a wall-clock time in microseconds since the Unix epoch"""
+    return (UNIX_EPOCH + timedelta(microseconds=ts_us)).isoformat()
+
+@dataclass(slots=True, eq=False)
+class BookOrder:
+    order_id: int
+    symbol_id: int
+    side: int
+    order_type: int
+    px_ticks: int  # 0 for market orders
+    quantity: int  # lots
+    remaining_quantity: int  # lots
+    status: int
+    ts_us: int  # wall-clock submit time, µs since the Unix epoch
+    # Intrusive links into the resting price level's FIFO (unset while not on the book)
+    level: Optional["PriceLevel"] = field(default=None, repr=False)
+    prev: Optional["BookOrder"] = field(default=None, repr=False)
+    next: Optional["BookOrder"] = field(default=None, repr=False)
+
+    def to_doc(self, book: "OrderBook") -> Dict:
+        """Wire/database form; the order's book supplies the symbol name and tick/lot sizes"""
+        spec = book.spec
+        return {
+            "order_id": str(self.order_id),
+            "symbol": book.symbol,
+            "order_type": ORDER_TYPES[self.order_type],
+            "side": SIDES[self.side],
+            "quantity": spec.qty(self.quantity),
+            "price": None if self.order_type == TYPE_MARKET else spec.price(self.px_ticks),
+            "remaining_quantity": spec.qty(self.remaining_quantity),
+            "status": STATUSES[self.status],
+            "timestamp": iso_timestamp(self.ts_us)
+        }
+
+@dataclass(slots=True)
+class BookTrade:
+    trade_id: int
+    ts_us: int
+    symbol: str
+    price: float
+    quantity: float
+    aggressor_side: int
+    maker_order_id: int
+    taker_order_id: int
+
+    def to_doc(self) -> Dict:
+        return {
+            "trade_id": str(self.trade_id),
+            "timestamp": iso_timestamp(self.ts_us),
+            "symbol": self.symbol,
+            "price": self.price,
+            "quantity": self.quantity,
+            "aggressor_side": SIDES[self.aggressor_side],
+            "maker_order_id": str(self.maker_order_id),
+            "taker_order_id": str(self.taker_order_id)
+        }
+
 # ============== MATCHING ENGINE ==============
 
+DEFAULT_TICK_SIZE = 0.01
+DEFAULT_LOT_SIZE = 1e-8
+# Coalescing window for batched WebSocket subscribers
+FLUSH_MS = 10
+# WebSocket fan-out: subscribers per feed are spread over shards, each with a bounded send queue
+NUM_SHARDS = 16
+# Latest-state feeds (book, BBO) drop their stalest frame once this many are queued
+SEND_QUEUE_SIZE = 4
+# Lossless feeds (trades, deltas) disconnect on overflow instead of dropping, so they must absorb
+# bursts: a single sweep emits one trade frame per maker
+LOSSLESS_SEND_QUEUE_SIZE = 4096
+# Full order book resync interval for delta subscribers
+SNAPSHOT_INTERVAL_S = 5
+# Write-behind persistence: flush every PERSIST_INTERVAL_MS or once PERSIST_BATCH_SIZE ops are pending
+PERSIST_INTERVAL_MS = 10
+PERSIST_BATCH_SIZE = 1000
+# Failed flushes are retried with exponential backoff up to PERSIST_RETRY_MAX_S, and a few
+# more times on shutdown
+PERSIST_RETRY_MAX_S = 5
+PERSIST_SHUTDOWN_ATTEMPTS = 3
+# Serialized REST snapshots kept across requests (LRU over (view, symbol, ..., book version))
+SNAPSHOT_CACHE_SIZE = 256
+
+@dataclass(slots=True, frozen=True)
+class SymbolSpec:
+    """Fixed-point grid of a symbol: prices are integer ticks and quantities integer lots"""
+    tick: float = DEFAULT_TICK_SIZE
+    lot: float = DEFAULT_LOT_SIZE
+
+    def px_to_ticks(self, price: float) -> int:
+        return int(round(price / self.tick))
+
+    def qty_to_lots(self, quantity: float) -> int:
+        return int(round(quantity / self.lot))
+
+    def price(self, ticks: int) -> float:
+        return round(ticks * self.tick, 10)
+
+    def qty(self, lots: int) -> float:
+        return round(lots * self.lot, 10)
+
+def on_grid(value: float, step: float, units: int) -> bool:
+    """Whether value is units * step, compared in grid units with a tolerance relative to
+    the magnitude so float rounding of large sizes (e.g. 9957.2635 / 1e-8) still passes"""
+    return math.isclose(value / step, units, rel_tol=1e-14, abs_tol=1e-6)
+
+DEFAULT_SPEC = SymbolSpec()
+# Per-symbol overrides; symbols not listed trade on DEFAULT_SPEC
+SYMBOL_SPECS: Dict[str, SymbolSpec] = {}
+
+class PriceLevel:
+    """FIFO queue of resting orders at a single price, with aggregate quantity in lots"""
+    __slots__ = ("key", "price", "head", "tail", "total_qty", "count")
+
+    def __init__(self, key: int, price: float):
+        self.key = key
+        self.price = price
+        self.head: Optional[BookOrder] = None
+        self.tail: Optional[BookOrder] = None
+        self.total_qty = 0
+        self.count = 0
+
+    def append(self, order: BookOrder):
+        order.level = self
+        order.prev = self.tail
+        if self.tail is None:
+            self.head = order
+        else:
+            self.tail.next = order
+        self.tail = order
+        self.total_qty += order.remaining_quantity
+        self.count += 1
+
+    def unlink(self, order: BookOrder):
+        if order.prev is None:
+            self.head = order.next
+        else:
+            order.prev.next = order.next
+        if order.next is None:
+            self.tail = order.prev
+        else:
+            order.next.prev = order.prev
+        order.level = order.prev = order.next = None
+        self.total_qty -= order.remaining_quantity
+        self.count -= 1
+
+class PriceLadder:
+    """Sorted index of one book side: tick keys ordered best price first beside a
+    ticks -> PriceLevel dict, with the best level cached so top-of-book reads are a
+    single attribute load. Bids sort through a reversed comparator rather than negated keys."""
+    __slots__ = ("best", "beyond", "_keys", "_levels")
+
+    def __init__(self, descending: bool = False):
+        self.best: Optional[PriceLevel] = None
+        # beyond(a, b): price a is worse than price b on this side
+        self.beyond = operator.lt if descending else operator.gt
+        self._keys = SortedKeyList(key=operator.neg) if descending else SortedList()
+        self._levels: Dict[int, PriceLevel] = {}
+
+    def __len__(self) -> int:
+        return len(self._levels)
+
+    def __bool__(self) -> bool:
+        return self.best is not None
+
+    def get(self, key: int) -> Optional[PriceLevel]:
+        return self._levels.get(key)
+
+    def add(self, level: PriceLevel):
+        self._levels[level.key] = level
+        self._keys.add(level.key)
+        if self.best is None or self.beyond(self.best.key, level.key):
+            self.best = level
+
+    def pop(self, key: int):
+        level = self._levels.pop(key, None)
+        if level is None:
+            return
+        self._keys.remove(key)
+        if level is self.best:
+            self.best = self._levels[self._keys[0]] if self._keys else None
+
+    def items(self) -> Iterator[Tuple[int, PriceLevel]]:
+        """(key, level) pairs from the best price outwards"""
+        levels = self._levels
+        return ((key, levels[key]) for key in self._keys)
+
+    def top(self, n: int) -> List[PriceLevel]:
+        levels = self._levels
+        return [levels[key] for key in self._keys.islice(0, n)]
+
+class OrderBook:
+    """Price-time priority book for a single symbol in integer ticks and lots"""
+    __slots__ = ("symbol", "symbol_id", "spec", "bids", "asks", "seq", "version", "dirty_bids", "dirty_asks")
+
+    def __init__(self, symbol: str, spec: SymbolSpec = DEFAULT_SPEC):
+        self.symbol = symbol
+        self.symbol_id = symbol_id(symbol)
+        self.spec = spec
+        self.bids = PriceLadder(descending=True)  # ticks -> PriceLevel (highest first)
+        self.asks = PriceLadder()  # ticks -> PriceLevel (lowest first)
+        # Levels modified since the last take_changes(), and the delta sequence number
+        self.seq = 0
+        # Bumped on every mutation; identifies cached snapshots of this exact state
+        self.version = 0
+        self.dirty_bids: Dict[int, PriceLevel] = {}
+        self.dirty_asks: Dict[int, PriceLevel] = {}
+
+    def insert(self, order: BookOrder):
+        """Append order to the tail of its price level"""
+        side = self.bids if order.side == SIDE_BUY else self.asks
+        key = order.px_ticks
+        level = side.get(key)
+        if level is None:
+            level = PriceLevel(key, self.spec.price(key))
+            side.add(level)
+        level.append(order)
+        self._touch(order.side, level)
+
+    def fill(self, order: BookOrder, quantity: int):
+        """Account for a partial or full fill of a resting order"""
+        order.level.total_qty -= quantity
+        self._touch(order.side, order.level)
+
+    def unlink(self, order: BookOrder):
+        """Remove order from its price level in O(1), dropping the level once empty"""
+        level = order.level
+        level.unlink(order)
+        self._touch(order.side, level)
+        if level.count == 0:
+            side = self.bids if order.side == SIDE_BUY else self.asks
+            side.pop(level.key)
+
+    def _touch(self, side: int, level: PriceLevel):
+        self.version += 1
+        if side == SIDE_BUY:
+            self.dirty_bids[level.key] = level
+        else:
+            self.dirty_asks[level.key] = level
+
+    def take_changes(self) -> List[list]:
+        """Drain modified levels as [side, price, new_quantity] (0 = level removed)"""
+        if not (self.dirty_bids or self.dirty_asks):
+            return []
+        qty = self.spec.qty
+        changes = [["bid", level.price, qty(level.total_qty)] for level in self.dirty_bids.values()]
+        changes.extend(["ask", level.price, qty(level.total_qty)] for level in self.dirty_asks.values())
+        self.dirty_bids.clear()
+        self.dirty_asks.clear()
+        self.seq += 1
+        return changes
+
+    def can_fill(self, side: int, px_ticks: int, quantity: int) -> bool:
+        """Whether resting liquidity at or better than px_ticks covers quantity (lots) for an incoming order"""
+        levels = self.asks if side == SIDE_BUY else self.bids
+        beyond = levels.beyond
+        
+        # Levels run from the best price outwards, so stop at the first one past the limit
+        available = 0
+        for key, level in levels.items():
+            if beyond(key, px_ticks):
+                return False
+            available += level.total_qty
+            if available >= quantity:
+                return True
+        return False
+
+    def top_of_book(self) -> Tuple[Optional[float], Optional[float], Optional[float], Optional[float]]:
+        """(best_bid, best_bid_quantity, best_ask, best_ask_quantity) from the cached best levels"""
+        bid = self.bids.best
+        ask = self.asks.best
+        qty = self.spec.qty
+        return (
+            bid.price if bid is not None else None,
+            qty(bid.total_qty) if bid is not None else None,
+            ask.price if ask is not None else None,
+            qty(ask.total_qty) if ask is not None else None,
+        )
+
+    def depth(self, side: PriceLadder, depth: int) -> List[List[float]]:
+        """Top N [price, quantity] levels of one side"""
+        qty = self.spec.qty
+        return [[float(level.price), qty(level.total_qty)] for level in side.top(depth)]
+
+    def depth_into(self, rows: List[List[float]], side: PriceLadder, depth: int):
+        """Rewrite rows in place with the top N [price, quantity] levels, reusing its row lists"""
+        qty = self.spec.qty
+        n = 0
+        for _, level in itertools.islice(side.items(), depth):
+            if n < len(rows):
+                row = rows[n]
+                row[0] = level.price
+                row[1] = qty(level.total_qty)
+            else:
+                rows.append([level.price, qty(level.total_qty)])
+            n += 1
+        del rows[n:]
+
+class SendQueue:
+    """Bounded outbound frame queue with a dedicated writer task for one WebSocket client"""
+    __slots__ = ("ws", "shard", "drop_stale", "closed", "_queue", "_task", "_close_task")
+
+    def __init__(self, ws: WebSocket, shard: int, drop_stale: bool, start: bool = True):
+        self.ws = ws
+        self.shard = shard
+        self.drop_stale = drop_stale
+        self.closed = False
+        self._queue: asyncio.Queue = asyncio.Queue(
+            maxsize=SEND_QUEUE_SIZE if drop_stale else LOSSLESS_SEND_QUEUE_SIZE)
+        self._task: Optional[asyncio.Task] = None
+        self._close_task: Optional[asyncio.Task] = None
+        if start:
+            self.start()
+
+    def start(self, first: Optional[str] = None):
+        """Start sending, optionally with a frame that goes out ahead of everything queued so far"""
+        if not self.closed and self._task is None:
+            self._task = asyncio.create_task(self._writer(first))
+
+    def put(self, text: str) -> bool:
+        """Queue a frame without blocking; returns False once the client should be dropped"""
+        if self.closed:
+            return False
+        if self._queue.full():
+            if not self.drop_stale:
+                # Every frame matters on this feed, so a client that can't keep up is cut off
+                self.close()
+                # Keep a reference so the task isn't collected before it runs
+                self._close_task = asyncio.create_task(self._close_socket(1013))
+                return False
+            self._queue.get_nowait()  # Latest-state feed: discard the stalest frame
+        self._queue.put_nowait(text)
+        return True
+
+    async def _writer(self, first: Optional[str]):
+        try:
+            if first is not None:
+                await self.ws.send_text(first)
+            while True:
+                await self.ws.send_text(await self._queue.get())
+        except Exception:
+            self.closed = True
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.ws.close(code=code)
+        except Exception:
+            pass  # The socket is already gone
+
+    def close(self):
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+
+class Subscribers:
+    """WebSocket clients of one feed, spread round-robin over NUM_SHARDS shards"""
+    __slots__ = ("drop_stale", "shards", "_rr")
+
+    def __init__(self, drop_stale: bool):
+        self.drop_stale = drop_stale
+        self.shards: List[List[SendQueue]] = [[] for _ in range(NUM_SHARDS)]
+        self._rr = itertools.count()
+
+    def __bool__(self) -> bool:
+        return any(self.shards)
+
+    def add(self, ws: WebSocket, start: bool = True) -> SendQueue:
+        """Subscribe ws; with start=False frames are queued until client.start() is called"""
+        client = SendQueue(ws, next(self._rr) % NUM_SHARDS, self.drop_stale, start)
+        self.shards[client.shard].append(client)
+        return client
+
+    def remove(self, client: SendQueue):
+        client.close()
+        shard = self.shards[client.shard]
+        if client in shard:
+            shard.remove(client)
+
+    async def publish(self, text: str):
+        """Hand a frame to every client, yielding to the event loop between shards"""
+        for shard in self.shards:
+            if shard:
+                self._fan_shard(shard, text)
+                await asyncio.sleep(0)
+
+    @staticmethod
+    def _fan_shard(shard: List[SendQueue], text: str):
+        dropped = [client for client in shard if not client.put(text)]
+        for client in dropped:
+            shard.remove(client)
+
 class MatchingEngine:
     def __init__(self):
-        # Order books for each symbol: symbol -> {"bids": SortedDict, "asks": SortedDict}
-        self.order_books: Dict[str, Dict] = {}
-        # Active orders: order_id -> Order
-        self.active_orders: Dict[str, Order] = {}
-        # WebSocket connections
-        self.orderbook_connections: List[WebSocket] = []
-        self.trade_connections: List[WebSocket] = []
-        self.bbo_connections: List[WebSocket] = []
-        self.lock = asyncio.Lock()
-    
-    def ensure_order_book(self, symbol: str):
+        # Order books for each symbol: symbol -> OrderBook
+        self.order_books: Dict[str, OrderBook] = {}
+        self._books_by_id: Dict[int, OrderBook] = {}
+        # Active (resting) orders: order_id -> BookOrder, linked into their price level
+        self.active_orders: Dict[int, BookOrder] = {}
+        # Order and trade ID allocators (kept as ints internally, strings on the wire)
+        self._next_oid = IdAllocator(ID_KIND_ORDER)
+        self._next_tid = IdAllocator(ID_KIND_TRADE)
+        # Last BBO sent per symbol: (best_bid, best_bid_qty, best_ask, best_ask_qty)
+        self._last_bbo: Dict[str, tuple] = {}
+        # Per-symbol broadcast messages shaped like BBO / OrderBookSnapshot, refilled in place
+        self._bbo_messages: Dict[str, Dict] = {}
+        self._book_messages: Dict[str, Dict] = {}
+        # Updates pending for batched subscribers; only the latest book/BBO per symbol is kept
+        self._pending_book: Dict[str, Dict] = {}
+        self._pending_bbo: Dict[str, Dict] = {}
+        self._pending_trades: List[Dict] = []
+        # REST snapshot bytes, valid for as long as the book version they were built at
+        self._snapshot_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        # Per-symbol single-writer pipeline: orders on one symbol never block another
+        self.symbol_queues: Dict[str, asyncio.Queue] = {}
+        self._symbol_workers: Dict[str, asyncio.Task] = {}
+        # Database writes are buffered in memory and flushed in batches by a background task
+        self._trade_wal: deque = deque()
+        self._order_wal: deque = deque()
+        self._closing = False
+        self._persist_task: Optional[asyncio.Task] = None
+        self._background_tasks: List[asyncio.Task] = []
+        self._reset_runtime()
+    
+    def _reset_runtime(self):
+        """Create the executor, asyncio primitives and subscriber sets
+        
+        asyncio objects bind to the event loop that first uses them, so stop() calls this
+        again to let a later start() run on a fresh loop.
+        """
+        # WebSocket subscribers (per-event "stream"); book/BBO are latest-state feeds
+        self.orderbook_subscribers = Subscribers(drop_stale=True)
+        self.trade_subscribers = Subscribers(drop_stale=False)
+        self.bbo_subscribers = Subscribers(drop_stale=True)
+        # WebSocket subscribers ("batched", flushed every FLUSH_MS)
+        self.batched_orderbook_subscribers = Subscribers(drop_stale=True)
+        self.batched_trade_subscribers = Subscribers(drop_stale=False)
+        self.batched_bbo_subscribers = Subscribers(drop_stale=True)
+        # Order book delta subscribers; deltas are not idempotent, so frames are never dropped
+        self.delta_orderbook_subscribers = Subscribers(drop_stale=False)
+        self.symbol_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._cpu_pool = ThreadPoolExecutor(thread_name_prefix="matching")
+        self._wal_ready = asyncio.Event()
+        # WebSocket broadcasts are drained by a background task
+        self._broadcast_queue: asyncio.Queue = asyncio.Queue()
+    
+    def ensure_order_book(self, symbol: str) -> OrderBook:
         """Initialize order book for symbol if it doesn't exist"""
-        if symbol not in self.order_books:
-            self.order_books[symbol] = {
-                "bids": SortedDict(),  # price -> deque of orders (descending)
-                "asks": SortedDict()   # price -> deque of orders (ascending)
+        book = self.order_books.get(symbol)
+        if book is None:
+            book = self.order_books[symbol] = OrderBook(symbol, SYMBOL_SPECS.get(symbol, DEFAULT_SPEC))
+            self._books_by_id[book.symbol_id] = book
+            self._bbo_messages[symbol] = {
+                "symbol": symbol,
+                "best_bid": None,
+                "best_bid_quantity": None,
+                "best_ask": None,
+                "best_ask_quantity": None,
+                "timestamp": None
             }
+            self._book_messages[symbol] = {"timestamp": None, "symbol": symbol, "bids": [], "asks": []}
+        return book
     
-    def add_order_to_book(self, order: Order):
+    def add_order_to_book(self, order: BookOrder):
         """Add order to the order book"""
-        self.ensure_order_book(order.symbol)
-        book = self.order_books[order.symbol]
-        
-        if order.side == "buy":
-            price = -order.price  # Negate for descending order
-            if price not in book["bids"]:
-                book["bids"][price] = deque()
-            book["bids"][price].append(order)
-        else:  # sell
-            price = order.price
-            if price not in book["asks"]:
-                book["asks"][price] = deque()
-            book["asks"][price].append(order)
-        
+        book = self._books_by_id[order.symbol_id]
+        book.insert(order)
         self.active_orders[order.order_id] = order
     
-    def remove_order_from_book(self, order: Order):
+    def remove_order_from_book(self, order: BookOrder):
         """Remove order from the order book"""
-        book = self.order_books[order.symbol]
-        
-        if order.side == "buy":
-            if -order.price in book["bids"]:
-                try:
-                    book["bids"][-order.price].remove(order)
-                    if not book["bids"][-order.price]:
-                        del book["bids"][-order.price]
-                except ValueError:
-                    pass
-        else:  # sell
-            if order.price in book["asks"]:
-                try:
-                    book["asks"][order.price].remove(order)
-                    if not book["asks"][order.price]:
-                        del book["asks"][order.price]
-                except ValueError:
-                    pass
+        if order.level is not None:
+            self._books_by_id[order.symbol_id].unlink(order)
         
         if order.order_id in self.active_orders:
             del self.active_orders[order.order_id]
     
     def get_bbo(self, symbol: str) -> BBO:
         """Calculate and return Best Bid and Offer"""
-        self.ensure_order_book(symbol)
-        book = self.order_books[symbol]
-        bbo = BBO(symbol=symbol)
-        
-        # Best bid (highest price)
-        if book["bids"]:
-            best_bid_price = -book["bids"].keys()[0]  # First key (most negative = highest positive)
-            best_bid_quantity = sum(o.remaining_quantity for o in book["bids"][-best_bid_price])
-            bbo.best_bid = best_bid_price
-            bbo.best_bid_quantity = best_bid_quantity
-        
-        # Best ask (lowest price)
-        if book["asks"]:
-            best_ask_price = book["asks"].keys()[0]  # First key (lowest)
-            best_ask_quantity = sum(o.remaining_quantity for o in book["asks"][best_ask_price])
-            bbo.best_ask = best_ask_price
-            bbo.best_ask_quantity = best_ask_quantity
-        
-        return bbo
+        book = self.ensure_order_book(symbol)
+        best_bid, best_bid_quantity, best_ask, best_ask_quantity = book.top_of_book()
+        return BBO(
+            symbol=symbol,
+            best_bid=best_bid,
+            best_bid_quantity=best_bid_quantity,
+            best_ask=best_ask,
+            best_ask_quantity=best_ask_quantity
+        )
     
     def get_order_book_snapshot(self, symbol: str, depth: int = 10) -> OrderBookSnapshot:
         """Get order book snapshot with specified depth"""
-        self.ensure_order_book(symbol)
-        book = self.order_books[symbol]
-        
-        # Get top N bids (highest prices)
-        bids = []
-        for price in list(book["bids"].keys())[:depth]:
-            total_quantity = sum(o.remaining_quantity for o in book["bids"][price])
-            bids.append([float(-price), float(total_quantity)])
+        book = self.ensure_order_book(symbol)
         
-        # Get top N asks (lowest prices)
-        asks = []
-        for price in list(book["asks"].keys())[:depth]:
-            total_quantity = sum(o.remaining_quantity for o in book["asks"][price])
-            asks.append([float(price), float(total_quantity)])
+        return OrderBookSnapshot(
+            symbol=symbol,
+            bids=book.depth(book.bids, depth),  # Top N bids (highest prices)
+            asks=book.depth(book.asks, depth)   # Top N asks (lowest prices)
+        )
+    
+    async def order_book_snapshot_json(self, symbol: str, depth: int = 10) -> bytes:
+        """Order book snapshot as JSON bytes, re-serialized only after the book changes"""
+        return await self._cached_json(symbol, ("orderbook", symbol, depth),
+                                       lambda: self.get_order_book_snapshot(symbol, depth))
+    
+    async def bbo_json(self, symbol: str) -> bytes:
+        """BBO as JSON bytes, re-serialized only after the book changes"""
+        return await self._cached_json(symbol, ("bbo", symbol), lambda: self.get_bbo(symbol))
+    
+    async def _cached_json(self, symbol: str, view: tuple, build) -> bytes:
+        """Look up view at the book's current version, building it under the symbol lock on a miss
         
-        return OrderBookSnapshot(symbol=symbol, bids=bids, asks=asks)
+        Only versions observed with the lock held are ever cached, so a hit is always a
+        consistent state even while a match is running. The embedded timestamp is the
+        time the snapshot was built.
+        """
+        book = self.ensure_order_book(symbol)
+        cache = self._snapshot_cache
+        key = (*view, book.version)
+        buf = cache.get(key)
+        if buf is None:
+            async with self.symbol_locks[symbol]:
+                key = (*view, book.version)
+                buf = cache.get(key)
+                if buf is None:
+                    # orjson writes datetimes as isoformat() does (+00:00), matching the WebSocket frames
+                    buf = orjson.dumps(build().model_dump())
+                    cache[key] = buf
+                    if len(cache) > SNAPSHOT_CACHE_SIZE:
+                        cache.popitem(last=False)
+        cache.move_to_end(key)
+        return buf
     
-    async def execute_trade(self, maker_order: Order, taker_order: Order, 
-                           quantity: float, price: float) -> Trade:
-        """Execute a trade between maker and taker orders"""
-        trade = Trade(
-            symbol=maker_order.symbol,
+    def execute_trade(self, maker_order: BookOrder, taker_order: BookOrder,
+                      quantity: int, price: float) -> BookTrade:
+        """Execute a trade of quantity lots between maker and taker orders"""
+        book = self._books_by_id[maker_order.symbol_id]
+        trade = BookTrade(
+            trade_id=next(self._next_tid),
+            ts_us=taker_order.ts_us,  # Same request, same timestamp
+            symbol=book.symbol,
             price=price,
-            quantity=quantity,
+            quantity=book.spec.qty(quantity),
             aggressor_side=taker_order.side,
             maker_order_id=maker_order.order_id,
             taker_order_id=taker_order.order_id
         )
         
         # Update order quantities
+        if maker_order.level is not None:
+            book.fill(maker_order, quantity)
         maker_order.remaining_quantity -= quantity
         taker_order.remaining_quantity -= quantity
         
         # Update order statuses
         if maker_order.remaining_quantity == 0:
-            maker_order.status = "filled"
+            maker_order.status = STATUS_FILLED
             self.remove_order_from_book(maker_order)
         elif maker_order.remaining_quantity < maker_order.quantity:
-            maker_order.status = "partially_filled"
+            maker_order.status = STATUS_PARTIALLY_FILLED
         
         if taker_order.remaining_quantity == 0:
-            taker_order.status = "filled"
+            taker_order.status = STATUS_FILLED
         elif taker_order.remaining_quantity < taker_order.quantity:
-            taker_order.status = "partially_filled"
-        
-        # Save trade to database
-        trade_dict = trade.model_dump()
-        trade_dict["timestamp"] = trade_dict["timestamp"].isoformat()
-        await db.trades.insert_one(trade_dict)
+            taker_order.status = STATUS_PARTIALLY_FILLED
         
-        # Update orders in database
-        for order in [maker_order, taker_order]:
-            order_dict = order.model_dump()
-            order_dict["timestamp"] = order_dict["timestamp"].isoformat()
-            await db.orders.update_one(
-                {"order_id": order.order_id},
-                {"$set": order_dict},
-                upsert=True
-            )
-        
-        # Broadcast trade to WebSocket clients
-        await self.broadcast_trade(trade)
-        
-        logger.info(f"Trade executed: {trade.trade_id} - {quantity} @ {price} {trade.symbol}")
+        logger.info(f"Trade executed: {trade.trade_id} - {trade.quantity} @ {price} {trade.symbol}")
         return trade
     
-    async def match_order(self, order: Order) -> List[Trade]:
-        """Match an incoming order against the order book"""
+    def match_order(self, order: BookOrder, makers: List[BookOrder]) -> List[BookTrade]:
+        """Match an incoming order against the order book, collecting touched makers"""
         trades = []
-        self.ensure_order_book(order.symbol)
-        book = self.order_books[order.symbol]
+        book = self._books_by_id[order.symbol_id]
+        execute_trade = self.execute_trade
+        is_limit = order.order_type == TYPE_LIMIT
+        limit = order.px_ticks
         
-        if order.side == "buy":
-            # Match against asks (sells)
-            while order.remaining_quantity > 0 and book["asks"]:
-                best_ask_price = book["asks"].keys()[0]
-                
-                # For limit orders, check if price is acceptable
-                if order.order_type == "limit" and order.price < best_ask_price:
-                    break
-                
-                ask_orders = book["asks"][best_ask_price]
-                
-                while order.remaining_quantity > 0 and ask_orders:
-                    maker_order = ask_orders[0]  # FIFO
-                    
-                    # Determine trade quantity
-                    trade_quantity = min(order.remaining_quantity, maker_order.remaining_quantity)
-                    
-                    # Execute trade
-                    trade = await self.execute_trade(maker_order, order, trade_quantity, best_ask_price)
-                    trades.append(trade)
-                    
-                    if maker_order.remaining_quantity == 0:
-                        pass  # Already removed in execute_trade
+        # Match against the opposite side, best price first; a limit order stops
+        # at the first level priced beyond its own
+        levels = book.asks if order.side == SIDE_BUY else book.bids
+        beyond = levels.beyond
         
-        else:  # sell
-            # Match against bids (buys)
-            while order.remaining_quantity > 0 and book["bids"]:
-                best_bid_price = -book["bids"].keys()[0]
-                
-                # For limit orders, check if price is acceptable
-                if order.order_type == "limit" and order.price > best_bid_price:
-                    break
+        while order.remaining_quantity > 0 and levels:
+            level = levels.best
+            
+            # For limit orders, check if price is acceptable
+            if is_limit and beyond(level.key, limit):
+                break
+            
+            price = level.price
+            while order.remaining_quantity > 0 and level.count:
+                maker_order = level.head  # FIFO
                 
-                bid_orders = book["bids"][-best_bid_price]
+                # Determine trade quantity
+                trade_quantity = min(order.remaining_quantity, maker_order.remaining_quantity)
                 
-                while order.remaining_quantity > 0 and bid_orders:
-                    maker_order = bid_orders[0]  # FIFO
-                    
-                    # Determine trade quantity
-                    trade_quantity = min(order.remaining_quantity, maker_order.remaining_quantity)
-                    
-                    # Execute trade
-                    trade = await self.execute_trade(maker_order, order, trade_quantity, best_bid_price)
-                    trades.append(trade)
-                    
-                    if maker_order.remaining_quantity == 0:
-                        pass  # Already removed in execute_trade
+                # Execute trade (filled makers are removed in execute_trade)
+                trades.append(execute_trade(maker_order, order, trade_quantity, price))
+                makers.append(maker_order)
         
         return trades
     
+    def _match_sync(self, order: BookOrder) -> Tuple[List[BookTrade], List[BookOrder]]:
+        """Run the matching step for one order; pure in-memory, no I/O"""
+        trades = []
+        makers = []
+        
+        if order.order_type == TYPE_MARKET:
+            # Market order: match immediately at best available prices
+            trades = self.match_order(order, makers)
+            if order.remaining_quantity > 0:
+                order.status = STATUS_PARTIALLY_FILLED if trades else STATUS_CANCELLED
+                logger.warning(f"Market order {order.order_id} partially filled or cancelled - insufficient liquidity")
+        
+        elif order.order_type == TYPE_LIMIT:
+            # Limit order: match what can be matched, rest goes to book
+            trades = self.match_order(order, makers)
+            if order.remaining_quantity > 0:
+                self.add_order_to_book(order)
+        
+        elif order.order_type == TYPE_IOC:
+            # Immediate-Or-Cancel: match what can be matched, cancel the rest
+            trades = self.match_order(order, makers)
+            if order.remaining_quantity > 0:
+                order.status = STATUS_CANCELLED
+                logger.info(f"IOC order {order.order_id} - unfilled portion cancelled")
+        
+        elif order.order_type == TYPE_FOK:
+            # Fill-Or-Kill: only fill if entire order can be filled immediately
+            book = self._books_by_id[order.symbol_id]
+            
+            # Check if full order can be filled
+            if book.can_fill(order.side, order.px_ticks, order.quantity):
+                trades = self.match_order(order, makers)
+            else:
+                order.status = STATUS_CANCELLED
+                logger.info(f"FOK order {order.order_id} cancelled - cannot be fully filled")
+        
+        return trades, makers
+    
     async def submit_order(self, order_submission: OrderSubmission) -> Dict:
         """Submit a new order to the matching engine"""
-        async with self.lock:
-            # Validate order
-            if order_submission.order_type in ["limit", "ioc", "fok"] and order_submission.price is None:
-                raise ValueError(f"{order_submission.order_type.upper()} order requires a price")
-            
-            # Create order object
-            order = Order(
-                symbol=order_submission.symbol,
-                order_type=order_submission.order_type,
-                side=order_submission.side,
-                quantity=order_submission.quantity,
-                price=order_submission.price,
-                remaining_quantity=order_submission.quantity
-            )
-            
-            # Save order to database
-            order_dict = order.model_dump()
-            order_dict["timestamp"] = order_dict["timestamp"].isoformat()
-            await db.orders.insert_one(order_dict)
-            
-            logger.info(f"Order submitted: {order.order_id} - {order.side} {order.quantity} {order.symbol} @ {order.price}")
-            
-            # Process order based on type
-            trades = []
-            
-            if order.order_type == "market":
-                # Market order: match immediately at best available prices
-                trades = await self.match_order(order)
-                if order.remaining_quantity > 0:
-                    order.status = "partially_filled" if trades else "cancelled"
-                    logger.warning(f"Market order {order.order_id} partially filled or cancelled - insufficient liquidity")
-            
-            elif order.order_type == "limit":
-                # Limit order: match what can be matched, rest goes to book
-                trades = await self.match_order(order)
-                if order.remaining_quantity > 0:
-                    self.add_order_to_book(order)
-            
-            elif order.order_type == "ioc":
-                # Immediate-Or-Cancel: match what can be matched, cancel the rest
-                trades = await self.match_order(order)
-                if order.remaining_quantity > 0:
-                    order.status = "cancelled"
-                    logger.info(f"IOC order {order.order_id} - unfilled portion cancelled")
-            
-            elif order.order_type == "fok":
-                # Fill-Or-Kill: only fill if entire order can be filled immediately
-                self.ensure_order_book(order.symbol)
-                book = self.order_books[order.symbol]
-                
-                # Check if full order can be filled
-                can_fill = False
-                required_quantity = order.quantity
-                
-                if order.side == "buy":
-                    available = 0
-                    for price in book["asks"].keys():
-                        if order.price < price:
-                            break
-                        available += sum(o.remaining_quantity for o in book["asks"][price])
-                        if available >= required_quantity:
-                            can_fill = True
-                            break
-                else:  # sell
-                    available = 0
-                    for price in book["bids"].keys():
-                        if order.price > -price:
-                            break
-                        available += sum(o.remaining_quantity for o in book["bids"][price])
-                        if available >= required_quantity:
-                            can_fill = True
-                            break
-                
-                if can_fill:
-                    trades = await self.match_order(order)
-                else:
-                    order.status = "cancelled"
-                    logger.info(f"FOK order {order.order_id} cancelled - cannot be fully filled")
-            
-            # Broadcast updates
-            await self.broadcast_order_book(order.symbol)
-            await self.broadcast_bbo(order.symbol)
-            
-            return {
-                "order_id": order.order_id,
-                "status": order.status,
-                "filled_quantity": order.quantity - order.remaining_quantity,
-                "remaining_quantity": order.remaining_quantity,
-                "trades": [t.model_dump() for t in trades]
-            }
+        # Validate order
+        if order_submission.order_type in ["limit", "ioc", "fok"] and order_submission.price is None:
+            raise ValueError(f"{order_submission.order_type.upper()} order requires a price")
+        book = self.ensure_order_book(order_submission.symbol)
+        spec = book.spec
+        px_ticks = 0
+        if order_submission.price is not None:
+            px_ticks = spec.px_to_ticks(order_submission.price)
+            if not on_grid(order_submission.price, spec.tick, px_ticks):
+                raise ValueError(f"Price must be a multiple of tick size {spec.tick}")
+        lots = spec.qty_to_lots(order_submission.quantity)
+        if not on_grid(order_submission.quantity, spec.lot, lots):
+            raise ValueError(f"Quantity must be a multiple of lot size {spec.lot}")
+        
+        # Create order object
+        order = BookOrder(
+            order_id=next(self._next_oid),
+            symbol_id=book.symbol_id,
+            side=SIDES.index(order_submission.side),
+            order_type=ORDER_TYPES.index(order_submission.order_type),
+            px_ticks=px_ticks,
+            quantity=lots,
+            remaining_quantity=lots,
+            status=STATUS_OPEN,
+            ts_us=time.time_ns() // 1000
+        )
+        
+        logger.info(f"Order submitted: {order.order_id} - {order_submission.side} {order_submission.quantity} {order_submission.symbol} @ {order_submission.price}")
+        
+        # Hand off to the symbol's single-writer worker and wait for the outcome
+        future = asyncio.get_running_loop().create_future()
+        self._symbol_queue(order_submission.symbol).put_nowait((order, future))
+        return await future
+    
+    def _symbol_queue(self, symbol: str) -> asyncio.Queue:
+        """Get the symbol's order queue, spawning its worker on first use"""
+        queue = self.symbol_queues.get(symbol)
+        if queue is None:
+            queue = self.symbol_queues[symbol] = asyncio.Queue()
+            self._symbol_workers[symbol] = asyncio.create_task(self._symbol_worker(symbol))
+        return queue
     
-    async def broadcast_order_book(self, symbol: str):
-        """Broadcast order book update to all connected clients"""
-        snapshot = self.get_order_book_snapshot(symbol)
-        message = snapshot.model_dump()
-        message["timestamp"] = message["timestamp"].isoformat()
+    async def _symbol_worker(self, symbol: str):
+        """Process orders for one symbol strictly in arrival order"""
+        queue = self.symbol_queues[symbol]
+        book = self.ensure_order_book(symbol)
+        loop = asyncio.get_running_loop()
         
-        disconnected = []
-        for ws in self.orderbook_connections:
+        while True:
+            order, future = await queue.get()
             try:
-                await ws.send_json(message)
-            except:
-                disconnected.append(ws)
+                async with self.symbol_locks[symbol]:
+                    trades, makers = await loop.run_in_executor(self._cpu_pool, self._match_sync, order)
+                    
+                    # Serialize each trade once for the WAL, the broadcast and the response
+                    trade_docs = [trade.to_doc() for trade in trades]
+                    
+                    # Queue persistence and broadcasts; never awaited on this path
+                    order_doc = order.to_doc(book)
+                    self._persist(self._order_wal, order_doc)
+                    for doc in trade_docs:
+                        # insert_many adds _id to what it writes, so hand it a copy
+                        self._persist(self._trade_wal, dict(doc))
+                    for maker_order in makers:
+                        self._persist(self._order_wal, maker_order.to_doc(book))
+                    
+                    for doc in trade_docs:
+                        self.broadcast_trade(doc)
+                    self.broadcast_order_book(symbol, order_doc["timestamp"])
+                    self.broadcast_bbo(symbol, order_doc["timestamp"])
+                
+                if not future.done():
+                    future.set_result({
+                        "order_id": str(order.order_id),
+                        "status": STATUSES[order.status],
+                        "filled_quantity": book.spec.qty(order.quantity - order.remaining_quantity),
+                        "remaining_quantity": book.spec.qty(order.remaining_quantity),
+                        "trades": trade_docs
+                    })
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
+    
+    def _persist(self, wal: deque, doc: Dict):
+        """Buffer a document for the background batch writer"""
+        wal.append(doc)
+        if len(wal) >= PERSIST_BATCH_SIZE:
+            self._wal_ready.set()
+    
+    async def _persist_loop(self):
+        """Flush buffered trades and orders every PERSIST_INTERVAL_MS, or sooner when a batch fills up"""
+        delay = 0.0
+        while not self._closing:
+            if delay:
+                # Database unavailable: back off rather than waking on every filled batch
+                await asyncio.sleep(delay)
+            else:
+                try:
+                    await asyncio.wait_for(self._wal_ready.wait(), PERSIST_INTERVAL_MS / 1000)
+                except asyncio.TimeoutError:
+                    pass
+            self._wal_ready.clear()
+            if await self._flush_wal():
+                delay = 0.0
+            else:
+                delay = min(max(delay * 2, PERSIST_INTERVAL_MS / 1000), PERSIST_RETRY_MAX_S)
         
-        for ws in disconnected:
-            self.orderbook_connections.remove(ws)
+        for attempt in range(PERSIST_SHUTDOWN_ATTEMPTS):
+            if await self._flush_wal():
+                return
+            await asyncio.sleep(PERSIST_INTERVAL_MS / 1000 * 2 ** attempt)
+        logger.error(f"Shutting down with {len(self._trade_wal)} trades and "
+                     f"{len(self._order_wal)} order updates not persisted")
     
-    async def broadcast_trade(self, trade: Trade):
-        """Broadcast trade execution to all connected clients"""
-        message = trade.model_dump()
-        message["timestamp"] = message["timestamp"].isoformat()
+    async def _flush_wal(self) -> bool:
+        """Write everything buffered so far with insert_many / bulk_write
         
-        disconnected = []
-        for ws in self.trade_connections:
+        A batch that fails outright (e.g. the database is unreachable) goes back to the front
+        of its WAL and False is returned so the caller retries later. Retrying is safe: trades
+        written by an earlier attempt come back as duplicate key errors, which count as
+        persisted, and order upserts are idempotent.
+        """
+        while self._trade_wal:
+            batch = [self._trade_wal.popleft() for _ in range(min(len(self._trade_wal), PERSIST_BATCH_SIZE))]
             try:
-                await ws.send_json(message)
-            except:
-                disconnected.append(ws)
+                await db.trades.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                self._log_rejected("trades", e)
+            except Exception as e:
+                self._trade_wal.extendleft(reversed(batch))
+                logger.error(f"Error persisting {len(batch)} trades, will retry: {e}")
+                return False
         
-        for ws in disconnected:
-            self.trade_connections.remove(ws)
-    
-    async def broadcast_bbo(self, symbol: str):
-        """Broadcast BBO update to all connected clients"""
-        bbo = self.get_bbo(symbol)
-        message = bbo.model_dump()
-        message["timestamp"] = message["timestamp"].isoformat()
+        while self._order_wal:
+            # Only the latest state of each order needs writing
+            latest: Dict[str, Dict] = {}
+            for _ in range(min(len(self._order_wal), PERSIST_BATCH_SIZE)):
+                doc = self._order_wal.popleft()
+                latest[doc["order_id"]] = doc
+            try:
+                await db.orders.bulk_write(
+                    [UpdateOne({"order_id": order_id}, {"$set": doc}, upsert=True)
+                     for order_id, doc in latest.items()],
+                    ordered=False
+                )
+            except BulkWriteError as e:
+                self._log_rejected("orders", e)
+            except Exception as e:
+                self._order_wal.extendleft(reversed(latest.values()))
+                logger.error(f"Error persisting {len(latest)} orders, will retry: {e}")
+                return False
+        return True
+    
+    @staticmethod
+    def _log_rejected(collection: str, error: BulkWriteError):
+        """Log documents the database refused; duplicates were already written by an earlier attempt"""
+        rejected = [err for err in error.details.get("writeErrors", []) if err.get("code") != 11000]
+        if rejected:
+            logger.error(f"Dropping {len(rejected)} {collection} rejected by the database: {rejected[0].get('errmsg')}")
+    
+    async def _broadcaster(self):
+        """Deliver queued pre-serialized WebSocket messages"""
+        while True:
+            subscribers, text = await self._broadcast_queue.get()
+            try:
+                await subscribers.publish(text)
+            finally:
+                self._broadcast_queue.task_done()
+    
+    async def _ensure_indexes(self):
+        """Index the upsert keys and the (symbol, recency) read paths; no-op when they already exist
         
-        disconnected = []
-        for ws in self.bbo_connections:
+        Each index is created on its own so one failure (e.g. existing duplicate order_ids)
+        doesn't prevent the rest; only an unreachable database stops the remaining ones.
+        """
+        indexes = [
+            (db.orders, "order_id", {"unique": True}),
+            (db.trades, "trade_id", {"unique": True}),
+            (db.orders, [("symbol", 1), ("timestamp", -1)], {}),
+            (db.trades, [("symbol", 1), ("timestamp", -1)], {}),
+            (db.orders, [("timestamp", -1)], {}),
+            (db.trades, [("timestamp", -1)], {}),
+        ]
+        for position, (collection, keys, options) in enumerate(indexes):
             try:
-                await ws.send_json(message)
-            except:
-                disconnected.append(ws)
+                await collection.create_index(keys, **options)
+            except ConnectionFailure as e:
+                logger.error(f"Database unreachable, skipped {len(indexes) - position} indexes: {e}")
+                return
+            except Exception as e:
+                logger.error(f"Error creating index {keys} on {collection.name}: {e}")
+    
+    async def start(self):
+        """Start the background database writer and broadcaster"""
+        if self._persist_task is not None:
+            return
+        self._closing = False
+        self._persist_task = asyncio.create_task(self._persist_loop())
+        self._background_tasks = [
+            asyncio.create_task(self._broadcaster()),
+            asyncio.create_task(self._flusher()),
+            asyncio.create_task(self._snapshot_refresher()),
+            # Runs in the background so an unreachable database doesn't hold up startup
+            asyncio.create_task(self._ensure_indexes()),
+        ]
+    
+    async def stop(self):
+        """Drain pending orders and broadcasts, flush buffered writes, then stop all tasks"""
+        for queue in self.symbol_queues.values():
+            await queue.join()
+        await self._broadcast_queue.join()
         
-        for ws in disconnected:
-            self.bbo_connections.remove(ws)
+        if self._persist_task is not None:
+            self._closing = True
+            self._wal_ready.set()
+            await self._persist_task
+            self._persist_task = None
+        
+        for task in [*self._symbol_workers.values(), *self._background_tasks]:
+            task.cancel()
+        await asyncio.gather(*self._symbol_workers.values(), *self._background_tasks, return_exceptions=True)
+        self.symbol_queues.clear()
+        self._symbol_workers.clear()
+        self._background_tasks = []
+        self._cpu_pool.shutdown(wait=False)
+        self._reset_runtime()
+    
+    async def _flusher(self):
+        """Periodically send coalesced updates to batched subscribers"""
+        while True:
+            await asyncio.sleep(FLUSH_MS / 1000)
+            await self._flush_batched()
+    
+    async def _flush_batched(self):
+        """Serialize each channel's pending updates once and send them as one frame per client"""
+        books, self._pending_book = self._pending_book, {}
+        bbos, self._pending_bbo = self._pending_bbo, {}
+        trades, self._pending_trades = self._pending_trades, []
+        
+        for subscribers, messages in (
+            (self.batched_orderbook_subscribers, list(books.values())),
+            (self.batched_trade_subscribers, trades),
+            (self.batched_bbo_subscribers, list(bbos.values())),
+        ):
+            if messages and subscribers:
+                await subscribers.publish(orjson.dumps(messages).decode())
+    
+    async def _snapshot_refresher(self):
+        """Periodically resync delta subscribers with full order books"""
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL_S)
+            await self.resync_delta_subscribers()
+    
+    async def resync_delta_subscribers(self):
+        """Queue one snapshot frame per symbol for delta subscribers
+        
+        Each frame is queued while its symbol's lock is held, so it lands on the broadcast
+        queue after every delta it already reflects and before any delta it doesn't.
+        """
+        for symbol, book in list(self.order_books.items()):
+            if not self.delta_orderbook_subscribers:
+                return
+            async with self.symbol_locks[symbol]:
+                self._broadcast_queue.put_nowait(
+                    (self.delta_orderbook_subscribers, self._snapshot_frame([self._full_book(symbol, book)])))
+    
+    async def full_snapshot_message(self) -> str:
+        """Serialize every order book at full depth, tagged with its delta sequence number"""
+        books = []
+        for symbol, book in list(self.order_books.items()):
+            async with self.symbol_locks[symbol]:
+                books.append(self._full_book(symbol, book))
+        return self._snapshot_frame(books)
+    
+    @staticmethod
+    def _full_book(symbol: str, book: OrderBook) -> Dict:
+        return {
+            "symbol": symbol,
+            "seq": book.seq,
+            "bids": book.depth(book.bids, len(book.bids)),
+            "asks": book.depth(book.asks, len(book.asks))
+        }
+    
+    @staticmethod
+    def _snapshot_frame(books: List[Dict]) -> str:
+        return orjson.dumps({
+            "type": "snapshot",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "books": books
+        }).decode()
+    
+    def broadcast_order_book(self, symbol: str, timestamp: str):
+        """Queue order book update for all connected clients, stamped with the triggering order's timestamp"""
+        book = self.ensure_order_book(symbol)
+        changes = book.take_changes()
+        if not changes:
+            return  # Nothing visible changed
+        if self.delta_orderbook_subscribers:
+            delta = {"type": "delta", "symbol": symbol, "seq": book.seq, "changes": changes}
+            self._broadcast_queue.put_nowait((self.delta_orderbook_subscribers, orjson.dumps(delta).decode()))
+        if not (self.orderbook_subscribers or self.batched_orderbook_subscribers):
+            return
+        # Refill the symbol's message in place; a pending batched entry is the same
+        # object, so it always carries the latest book when flushed
+        message = self._book_messages[symbol]
+        message["timestamp"] = timestamp
+        book.depth_into(message["bids"], book.bids, 10)
+        book.depth_into(message["asks"], book.asks, 10)
+        if self.orderbook_subscribers:
+            # Serialize once; every stream subscriber gets the same frame
+            self._broadcast_queue.put_nowait((self.orderbook_subscribers, orjson.dumps(message).decode()))
+        if self.batched_orderbook_subscribers:
+            self._pending_book[symbol] = message
+    
+    def broadcast_trade(self, message: Dict):
+        """Queue a trade execution report (BookTrade.to_doc) for all connected clients"""
+        if not (self.trade_subscribers or self.batched_trade_subscribers):
+            return
+        if self.trade_subscribers:
+            # Serialize once; every stream subscriber gets the same frame
+            self._broadcast_queue.put_nowait((self.trade_subscribers, orjson.dumps(message).decode()))
+        if self.batched_trade_subscribers:
+            self._pending_trades.append(message)
+    
+    def broadcast_bbo(self, symbol: str, timestamp: str):
+        """Queue BBO update for all connected clients when it changed, stamped with the triggering order's timestamp"""
+        # Compare against the cached top of book before building any message
+        current = self.ensure_order_book(symbol).top_of_book()
+        if self._last_bbo.get(symbol) == current:
+            return
+        self._last_bbo[symbol] = current
+        if not (self.bbo_subscribers or self.batched_bbo_subscribers):
+            return
+        message = self._bbo_messages[symbol]
+        (message["best_bid"], message["best_bid_quantity"],
+         message["best_ask"], message["best_ask_quantity"]) = current
+        message["timestamp"] = timestamp
+        if self.bbo_subscribers:
+            # Serialize once; every stream subscriber gets the same frame
+            self._broadcast_queue.put_nowait((self.bbo_subscribers, orjson.dumps(message).decode()))
+        if self.batched_bbo_subscribers:
+            self._pending_bbo[symbol] = message
 
 # Global matching engine instance
 matching_engine = MatchingEngine()
@@ -461,8 +1137,8 @@ async def submit_order(order: OrderSubmission):
 async def get_order_book(symbol: str, depth: int = 10):
     """Get current order book snapshot for a symbol"""
     try:
-        snapshot = matching_engine.get_order_book_snapshot(symbol, depth)
-        return snapshot
+        buf = await matching_engine.order_book_snapshot_json(symbol, depth)
+        return Response(content=buf, media_type="application/json")
     except Exception as e:
         logger.error(f"Error getting order book: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -471,8 +1147,8 @@ async def get_order_book(symbol: str, depth: int = 10):
 async def get_bbo(symbol: str):
     """Get current Best Bid and Offer for a symbol"""
     try:
-        bbo = matching_engine.get_bbo(symbol)
-        return bbo
+        buf = await matching_engine.bbo_json(symbol)
+        return Response(content=buf, media_type="application/json")
     except Exception as e:
         logger.error(f"Error getting BBO: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -507,10 +1183,28 @@ async def get_orders(symbol: Optional[str] = None, limit: int = 100):
 # ============== WEBSOCKET ROUTES ==============
 
 @app.websocket("/ws/orderbook")
-async def websocket_orderbook(websocket: WebSocket):
-    """WebSocket endpoint for real-time order book updates"""
+async def websocket_orderbook(websocket: WebSocket, mode: Literal["stream", "batched", "delta"] = "stream"):
+    """WebSocket endpoint for real-time order book updates
+
+    In "delta" mode the client receives {"type": "snapshot", "books": [...]} frames with
+    books at full depth (every book on connect, then one frame per book every
+    SNAPSHOT_INTERVAL_S), plus
+    {"type": "delta", "symbol", "seq", "changes": [[side, price, quantity], ...]} frames.
+    The initial snapshot is always the first frame. A delta applies on top of a book
+    only if its seq is greater than the book's snapshot seq; older ones are already
+    reflected in the snapshot.
+    """
     await websocket.accept()
-    matching_engine.orderbook_connections.append(websocket)
+    if mode == "delta":
+        subscribers = matching_engine.delta_orderbook_subscribers
+    else:
+        subscribers = (matching_engine.batched_orderbook_subscribers if mode == "batched"
+                       else matching_engine.orderbook_subscribers)
+    # Delta clients subscribe before the snapshot is built so no delta is missed, but
+    # their writer is held until the snapshot can go out ahead of the queued deltas
+    client = subscribers.add(websocket, start=mode != "delta")
+    if mode == "delta":
+        client.start(await matching_engine.full_snapshot_message())
     logger.info("Client connected to order book stream")
     
     try:
@@ -518,14 +1212,16 @@ async def websocket_orderbook(websocket: WebSocket):
             # Keep connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
-        matching_engine.orderbook_connections.remove(websocket)
+        subscribers.remove(client)
         logger.info("Client disconnected from order book stream")
 
 @app.websocket("/ws/trades")
-async def websocket_trades(websocket: WebSocket):
+async def websocket_trades(websocket: WebSocket, mode: Literal["stream", "batched"] = "stream"):
     """WebSocket endpoint for real-time trade execution feed"""
     await websocket.accept()
-    matching_engine.trade_connections.append(websocket)
+    subscribers = (matching_engine.batched_trade_subscribers if mode == "batched"
+                   else matching_engine.trade_subscribers)
+    client = subscribers.add(websocket)
     logger.info("Client connected to trade stream")
     
     try:
@@ -533,14 +1229,16 @@ async def websocket_trades(websocket: WebSocket):
             # Keep connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
-        matching_engine.trade_connections.remove(websocket)
+        subscribers.remove(client)
         logger.info("Client disconnected from trade stream")
 
 @app.websocket("/ws/bbo")
-async def websocket_bbo(websocket: WebSocket):
+async def websocket_bbo(websocket: WebSocket, mode: Literal["stream", "batched"] = "stream"):
     """WebSocket endpoint for real-time BBO updates"""
     await websocket.accept()
-    matching_engine.bbo_connections.append(websocket)
+    subscribers = (matching_engine.batched_bbo_subscribers if mode == "batched"
+                   else matching_engine.bbo_subscribers)
+    client = subscribers.add(websocket)
     logger.info("Client connected to BBO stream")
     
     try:
@@ -548,7 +1246,7 @@ async def websocket_bbo(websocket: WebSocket):
             # Keep connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
-        matching_engine.bbo_connections.remove(websocket)
+        subscribers.remove(client)
         logger.info("Client disconnected from BBO stream")
 
 # Include the router in the main app
@@ -563,6 +1261,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_matching_engine():
+    await matching_engine.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await matching_engine.stop()
     client.close()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        app,
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        log_level="info",
+        access_log=False,  # Per-request access logging is a large hidden cost on hot endpoints
+    )
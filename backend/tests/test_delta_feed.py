@@ -0,0 +1,85 @@
+import asyncio
+
+import orjson
+
+from server import MatchingEngine, OrderSubmission
+
+
+class NullSocket:
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+def limit(symbol, side, price, quantity=1.0):
+    return OrderSubmission(symbol=symbol, order_type="limit", side=side, quantity=quantity, price=price)
+
+
+def drain(engine):
+    frames = []
+    while not engine._broadcast_queue.empty():
+        subscribers, text = engine._broadcast_queue.get_nowait()
+        if subscribers is engine.delta_orderbook_subscribers:
+            frames.append(orjson.loads(text))
+    return frames
+
+
+def apply(frames):
+    """Follow the client protocol from the websocket_orderbook docstring"""
+    books = {}
+    for frame in frames:
+        if frame["type"] == "snapshot":
+            for snap in frame["books"]:
+                books[snap["symbol"]] = {
+                    "seq": snap["seq"],
+                    "bid": {price: qty for price, qty in snap["bids"]},
+                    "ask": {price: qty for price, qty in snap["asks"]},
+                }
+        else:
+            book = books.get(frame["symbol"])
+            if book is None or frame["seq"] <= book["seq"]:
+                continue
+            book["seq"] = frame["seq"]
+            for side, price, qty in frame["changes"]:
+                if qty:
+                    book[side][price] = qty
+                else:
+                    book[side].pop(price, None)
+    return books
+
+
+def test_resync_snapshot_never_trails_newer_deltas():
+    async def go():
+        engine = MatchingEngine()
+        engine.delta_orderbook_subscribers.add(NullSocket(), start=False)
+        await engine.submit_order(limit("A", "sell", 100.0))
+        await engine.submit_order(limit("B", "sell", 100.0))
+        frames = drain(engine)
+        frames.append(orjson.loads(await engine.full_snapshot_message()))
+
+        # Hold B while the resync runs, and change A in the meantime
+        await engine.symbol_locks["B"].acquire()
+        resync = asyncio.create_task(engine.resync_delta_subscribers())
+        await asyncio.sleep(0)
+        await engine.submit_order(limit("A", "sell", 101.0))
+        engine.symbol_locks["B"].release()
+        await resync
+        frames.extend(drain(engine))
+
+        last_delta = {}
+        for frame in frames:
+            if frame["type"] == "delta":
+                last_delta[frame["symbol"]] = frame["seq"]
+            else:
+                for snap in frame["books"]:
+                    assert snap["seq"] >= last_delta.get(snap["symbol"], 0)
+
+        books = apply(frames)
+        for symbol in ("A", "B"):
+            book = engine.order_books[symbol]
+            assert sorted(books[symbol]["ask"].items()) == [tuple(row) for row in book.depth(book.asks, 100)]
+            assert books[symbol]["seq"] == book.seq
+
+    asyncio.run(go())
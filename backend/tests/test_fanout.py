@@ -0,0 +1,81 @@
+import asyncio
+
+from server import LOSSLESS_SEND_QUEUE_SIZE, SEND_QUEUE_SIZE, Subscribers
+
+
+class SlowSocket:
+    """Stands in for a WebSocket whose sends take 1 ms each"""
+
+    def __init__(self):
+        self.frames = []
+        self.close_code = None
+
+    async def send_text(self, text):
+        await asyncio.sleep(0.001)
+        self.frames.append(text)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def publish_burst(drop_stale, count):
+    async def go():
+        ws = SlowSocket()
+        subscribers = Subscribers(drop_stale=drop_stale)
+        client = subscribers.add(ws)
+        for i in range(count):
+            await subscribers.publish(str(i))
+        await asyncio.sleep(0.001 * count + 0.05)
+        subscribers.remove(client)
+        return ws, client
+    return asyncio.run(go())
+
+
+def test_lossless_feed_absorbs_sweep_burst():
+    # One market order sweeping 10 makers emits 10 trade frames back to back
+    ws, _ = publish_burst(drop_stale=False, count=10)
+    assert ws.frames == [str(i) for i in range(10)]
+    assert ws.close_code is None
+
+
+def test_latest_state_feed_drops_stale_frames():
+    ws, _ = publish_burst(drop_stale=True, count=10)
+    assert ws.frames[-1] == "9"
+    assert len(ws.frames) <= SEND_QUEUE_SIZE + 1
+    assert ws.close_code is None
+
+
+def test_held_client_sends_first_frame_ahead_of_queued_frames():
+    async def go():
+        ws = SlowSocket()
+        subscribers = Subscribers(drop_stale=False)
+        client = subscribers.add(ws, start=False)
+        for i in range(SEND_QUEUE_SIZE * 2):
+            await subscribers.publish(f"delta{i}")
+        client.start("snapshot")
+        await asyncio.sleep(0.05)
+        subscribers.remove(client)
+        return ws
+    ws = asyncio.run(go())
+    assert ws.frames == ["snapshot"] + [f"delta{i}" for i in range(SEND_QUEUE_SIZE * 2)]
+    assert ws.close_code is None
+
+
+def test_overflow_close_failure_is_swallowed():
+    class BrokenSocket(SlowSocket):
+        async def close(self, code=1000):
+            raise RuntimeError("already closed")
+
+    async def go():
+        loop = asyncio.get_running_loop()
+        errors = []
+        loop.set_exception_handler(lambda _, context: errors.append(context))
+        ws = BrokenSocket()
+        subscribers = Subscribers(drop_stale=False)
+        client = subscribers.add(ws, start=False)
+        for i in range(LOSSLESS_SEND_QUEUE_SIZE + 1):
+            client.put(str(i))
+        assert client.closed
+        await client._close_task
+        return errors
+    assert asyncio.run(go()) == []
@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from server import ID_KIND_ORDER, ID_KIND_TRADE, IdAllocator
+
+
+def test_order_and_trade_ids_never_collide():
+    orders = IdAllocator(ID_KIND_ORDER)
+    trades = IdAllocator(ID_KIND_TRADE)
+    order_ids = [next(orders) for _ in range(10000)]
+    trade_ids = [next(trades) for _ in range(10000)]
+    assert not set(order_ids) & set(trade_ids)
+
+
+def test_ids_are_monotonic_past_sequence_exhaustion():
+    ids = IdAllocator(ID_KIND_ORDER)
+    drawn = [next(ids) for _ in range(3 * 4096)]
+    assert drawn == sorted(set(drawn))
+    assert 0 < drawn[-1] < 2 ** 63
+
+
+def test_ids_unique_across_threads():
+    ids = IdAllocator(ID_KIND_TRADE)
+    with ThreadPoolExecutor(8) as pool:
+        drawn = list(pool.map(lambda _: next(ids), range(20000)))
+    assert len(set(drawn)) == len(drawn)
+
+
+def test_node_id_is_range_checked():
+    with pytest.raises(ValueError):
+        IdAllocator(ID_KIND_ORDER, node=512)
@@ -0,0 +1,42 @@
+import asyncio
+
+from pymongo.errors import DuplicateKeyError, ServerSelectionTimeoutError
+
+import server
+from server import MatchingEngine
+
+
+class IndexRecorder:
+    def __init__(self, name, fail_on=None, error=None):
+        self.name = name
+        self.fail_on = fail_on
+        self.error = error
+        self.created = []
+
+    async def create_index(self, keys, **options):
+        if keys == self.fail_on:
+            raise self.error
+        self.created.append(keys)
+
+
+class FakeDB:
+    def __init__(self, orders, trades):
+        self.orders = orders
+        self.trades = trades
+
+
+def test_one_failed_index_does_not_skip_the_rest(monkeypatch):
+    orders = IndexRecorder("orders", fail_on="order_id", error=DuplicateKeyError("dup order_id"))
+    trades = IndexRecorder("trades")
+    monkeypatch.setattr(server, "db", FakeDB(orders, trades))
+    asyncio.run(MatchingEngine()._ensure_indexes())
+    assert orders.created == [[("symbol", 1), ("timestamp", -1)], [("timestamp", -1)]]
+    assert trades.created == ["trade_id", [("symbol", 1), ("timestamp", -1)], [("timestamp", -1)]]
+
+
+def test_unreachable_database_stops_early(monkeypatch):
+    orders = IndexRecorder("orders", fail_on="order_id", error=ServerSelectionTimeoutError("down"))
+    trades = IndexRecorder("trades")
+    monkeypatch.setattr(server, "db", FakeDB(orders, trades))
+    asyncio.run(MatchingEngine()._ensure_indexes())
+    assert orders.created == [] and trades.created == []
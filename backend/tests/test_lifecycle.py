@@ -0,0 +1,15 @@
+from fastapi.testclient import TestClient
+
+import server
+from test_persistence import FakeDB
+
+
+def test_app_can_start_twice(monkeypatch):
+    monkeypatch.setattr(server, "db", FakeDB(failures=0))
+    for _ in range(2):
+        with TestClient(server.app) as client:
+            response = client.post("/api/orders", json={
+                "symbol": "RESTART", "order_type": "limit", "side": "buy", "quantity": 1.0, "price": 10.0
+            })
+            assert response.status_code == 200, response.text
+            assert client.get("/api/bbo/RESTART").json()["best_bid"] == 10.0
@@ -0,0 +1,91 @@
+import asyncio
+import random
+
+import pytest
+
+from server import DEFAULT_SPEC, MatchingEngine, OrderSubmission, on_grid
+
+
+def run(*orders):
+    """Submit orders in sequence on a fresh engine; returns (engine, results)"""
+    engine = MatchingEngine()
+
+    async def go():
+        return [await engine.submit_order(OrderSubmission(symbol="BTC-USDT", **o)) for o in orders]
+    return engine, asyncio.run(go())
+
+
+def test_on_grid_accepts_large_lot_multiples():
+    rng = random.Random(0)
+    for _ in range(20000):
+        quantity = float(f"{rng.uniform(0, 100000):.8f}")
+        assert on_grid(quantity, DEFAULT_SPEC.lot, DEFAULT_SPEC.qty_to_lots(quantity)), quantity
+        price = float(f"{rng.uniform(0, 100000):.2f}")
+        assert on_grid(price, DEFAULT_SPEC.tick, DEFAULT_SPEC.px_to_ticks(price)), price
+
+
+def test_on_grid_rejects_off_grid_values():
+    assert not on_grid(0.123456789, DEFAULT_SPEC.lot, DEFAULT_SPEC.qty_to_lots(0.123456789))
+    assert not on_grid(100.005, DEFAULT_SPEC.tick, DEFAULT_SPEC.px_to_ticks(100.005))
+
+
+def test_submit_accepts_large_quantity():
+    _, [result] = run(dict(order_type="limit", side="buy", quantity=9957.2635, price=100.0))
+    assert result["status"] == "open"
+    assert result["remaining_quantity"] == 9957.2635
+
+
+def test_submit_rejects_sub_lot_quantity():
+    with pytest.raises(ValueError, match="lot size"):
+        run(dict(order_type="limit", side="buy", quantity=0.123456789, price=100.0))
+
+
+def test_limit_sweep_price_time_priority():
+    engine, results = run(
+        dict(order_type="limit", side="sell", quantity=0.1, price=101.0),
+        dict(order_type="limit", side="sell", quantity=0.2, price=100.0),
+        dict(order_type="limit", side="sell", quantity=0.3, price=100.0),
+        dict(order_type="limit", side="sell", quantity=1.0, price=102.0),
+        dict(order_type="limit", side="buy", quantity=0.6, price=101.0),
+    )
+    result = results[-1]
+    assert [(t["price"], t["quantity"]) for t in result["trades"]] == [(100.0, 0.2), (100.0, 0.3), (101.0, 0.1)]
+    assert result["status"] == "filled"
+    assert result["remaining_quantity"] == 0.0
+    bbo = engine.get_bbo("BTC-USDT")
+    assert (bbo.best_bid, bbo.best_ask, bbo.best_ask_quantity) == (None, 102.0, 1.0)
+
+
+def test_bids_sort_highest_first():
+    engine, _ = run(
+        dict(order_type="limit", side="buy", quantity=1.0, price=99.0),
+        dict(order_type="limit", side="buy", quantity=1.0, price=100.0),
+        dict(order_type="limit", side="buy", quantity=1.0, price=98.5),
+    )
+    assert engine.get_order_book_snapshot("BTC-USDT").bids == [[100.0, 1.0], [99.0, 1.0], [98.5, 1.0]]
+
+
+def test_fok_fills_fully_or_cancels():
+    _, [_, _, killed, filled] = run(
+        dict(order_type="limit", side="buy", quantity=1.0, price=99.0),
+        dict(order_type="limit", side="buy", quantity=1.0, price=100.0),
+        dict(order_type="fok", side="sell", quantity=2.5, price=99.0),
+        dict(order_type="fok", side="sell", quantity=1.5, price=99.0),
+    )
+    assert killed["status"] == "cancelled" and killed["trades"] == []
+    assert [(t["price"], t["quantity"]) for t in filled["trades"]] == [(100.0, 1.0), (99.0, 0.5)]
+
+
+def test_depth_into_reuses_rows():
+    engine, _ = run(
+        dict(order_type="limit", side="sell", quantity=1.0, price=101.0),
+        dict(order_type="limit", side="sell", quantity=2.0, price=102.0),
+    )
+    book = engine.order_books["BTC-USDT"]
+    rows = [[0.0, 0.0], [0.0, 0.0], [0.0, 0.0]]
+    first = rows[0]
+    book.depth_into(rows, book.asks, 10)
+    assert rows == [[101.0, 1.0], [102.0, 2.0]] and rows[0] is first
+    book.depth_into(rows, book.asks, 1)
+    assert rows == [[101.0, 1.0]]
+    assert book.depth(book.bids, 10) == [] and book.depth(book.asks, 10) == [[101.0, 1.0], [102.0, 2.0]]
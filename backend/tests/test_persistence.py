@@ -0,0 +1,67 @@
+import asyncio
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import server
+from server import MatchingEngine
+
+
+class FlakyCollection:
+    """Fails the first `failures` writes as if the database were unreachable"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.written = []
+
+    async def _write(self, docs):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection refused")
+        self.written.extend(docs)
+
+    async def insert_many(self, docs, ordered=True):
+        await self._write(docs)
+
+    async def bulk_write(self, ops, ordered=True):
+        await self._write(op._doc["$set"] for op in ops)
+
+
+class FakeDB:
+    def __init__(self, failures):
+        self.trades = FlakyCollection(failures)
+        self.orders = FlakyCollection(failures)
+
+
+def test_failed_flush_is_retried(monkeypatch):
+    fake = FakeDB(failures=1)
+    monkeypatch.setattr(server, "db", fake)
+    engine = MatchingEngine()
+    engine._persist(engine._trade_wal, {"trade_id": "1"})
+    engine._persist(engine._order_wal, {"order_id": "1", "status": "open"})
+    engine._persist(engine._order_wal, {"order_id": "1", "status": "filled"})
+
+    assert not asyncio.run(engine._flush_wal())
+    assert fake.trades.written == [] and len(engine._trade_wal) == 1
+
+    assert not asyncio.run(engine._flush_wal())  # trades go through, orders fail once
+    assert fake.trades.written == [{"trade_id": "1"}]
+    assert list(engine._order_wal) == [{"order_id": "1", "status": "filled"}]
+
+    assert asyncio.run(engine._flush_wal())
+    assert fake.orders.written == [{"order_id": "1", "status": "filled"}]
+    assert not engine._trade_wal and not engine._order_wal
+
+
+def test_duplicate_trades_count_as_persisted(monkeypatch):
+    class DuplicateTrades(FlakyCollection):
+        async def insert_many(self, docs, ordered=True):
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "duplicate key"}]})
+
+    fake = FakeDB(failures=0)
+    fake.trades = DuplicateTrades(failures=0)
+    monkeypatch.setattr(server, "db", fake)
+    engine = MatchingEngine()
+    engine._persist(engine._trade_wal, {"trade_id": "1"})
+
+    assert asyncio.run(engine._flush_wal())
+    assert not engine._trade_wal
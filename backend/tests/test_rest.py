@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+
+import server
+from test_persistence import FakeDB
+
+
+def test_snapshot_cache_and_timestamp_format(monkeypatch):
+    monkeypatch.setattr(server, "db", FakeDB(failures=0))
+    with TestClient(server.app) as client:
+        first = client.get("/api/orderbook/REST")
+        assert first.content == client.get("/api/orderbook/REST").content
+        assert first.json()["timestamp"].endswith("+00:00")
+        assert client.get("/api/bbo/REST").json()["timestamp"].endswith("+00:00")
+
+        client.post("/api/orders", json={
+            "symbol": "REST", "order_type": "limit", "side": "sell", "quantity": 2.0, "price": 10.0
+        })
+        assert client.get("/api/orderbook/REST").json()["asks"] == [[10.0, 2.0]]
+        assert client.get("/api/bbo/REST").json()["best_ask_quantity"] == 2.0